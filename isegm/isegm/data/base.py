@@ -1,8 +1,16 @@
+import os
 import random
 import pickle
+import shutil
+from pathlib import Path
+
+import cv2
 import numpy as np
 import torch
 from torchvision import transforms
+from torchvision.io import ImageReadMode, read_file, decode_jpeg
+from PIL import Image
+from isegm.utils.misc import file_cache_key, save_npy_atomic
 from .points_sampler import MultiPointSampler
 from .sample import DSample
 
@@ -26,6 +34,12 @@ class ISDataset(torch.utils.data.dataset.Dataset):
         self.with_image_info = with_image_info
         self.samples_precomputed_scores = self._load_samples_scores(samples_scores_path, samples_scores_gamma)
         self.to_tensor = transforms.ToTensor()
+        self.jpeg_decode_device = None
+        self.gpu_jpeg_decodable = {}
+        self.images_cache = None
+        self.images_cache_dir = None
+        self.images_cache_dir_limit = 50 * 2 ** 30
+        self.images_cache_dir_size = None
 
         self.dataset_samples = None
 
@@ -72,6 +86,87 @@ class ISDataset(torch.utils.data.dataset.Dataset):
     def get_sample(self, index) -> DSample:
         raise NotImplementedError
 
+    def load_image(self, image_path):
+        return self.load_image_nd(image_path)[0]
+
+    def load_image_nd(self, image_path):
+        """
+        Returns the image as a numpy array and, if it was just decoded on GPU,
+        also as a (H, W, 3) uint8 device tensor, so that it is not uploaded again (otherwise None).
+        """
+        image_nd = None
+        if self.images_cache is not None and image_path in self.images_cache:
+            return self.images_cache[image_path], image_nd
+
+        cache_path = None
+        if self.images_cache_dir is not None:
+            # Source path, size and mtime, so that a changed image is decoded again,
+            # and decoder, since nvJPEG and OpenCV outputs differ slightly
+            decoder = 'nvjpeg' if self.use_gpu_jpeg_decode(image_path) else 'cv2'
+            cache_path = Path(self.images_cache_dir) / f'{file_cache_key(image_path, decoder)}.npy'
+
+        if cache_path is not None and cache_path.exists():
+            image = np.load(cache_path)
+        else:
+            image, image_nd = self.decode_image(image_path)
+            if cache_path is not None and self.has_disk_space_for(image):
+                save_npy_atomic(cache_path, image)
+                self.images_cache_dir_size += image.nbytes
+
+        if self.images_cache is not None and self.has_memory_for(image):
+            # Shared between checkpoints, so in-place changes would leak into the next evaluation
+            image.setflags(write=False)
+            self.images_cache[image_path] = image
+        return image, image_nd
+
+    @staticmethod
+    def has_memory_for(image, reserve=4 * 2 ** 30):
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except ImportError:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        return available - image.nbytes > reserve
+
+    def has_disk_space_for(self, image, reserve=4 * 2 ** 30):
+        # Images are stored before resizing, and /dev/shm is RAM, so the directory is kept within
+        # images_cache_dir_limit bytes (existing files included) and leaves reserve bytes free
+        cache_dir = Path(self.images_cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if self.images_cache_dir_size is None:
+            self.images_cache_dir_size = sum(path.stat().st_size for path in cache_dir.glob('*.npy'))
+        if self.images_cache_dir_size + image.nbytes > self.images_cache_dir_limit:
+            return False
+        return shutil.disk_usage(cache_dir).free - image.nbytes > reserve
+
+    def decode_image(self, image_path):
+        # JPEGs may be decoded on GPU with nvJPEG, everything else goes through OpenCV
+        if self.use_gpu_jpeg_decode(image_path):
+            try:
+                image_nd = decode_jpeg(read_file(str(image_path)), mode=ImageReadMode.RGB,
+                                       device=self.jpeg_decode_device)
+                image_nd = image_nd.permute(1, 2, 0).contiguous()
+                # Host copy is still needed by Clicker, masks drawing and IoU code
+                return image_nd.cpu().numpy(), image_nd
+            except RuntimeError as e:
+                # Only files nvJPEG does not support fall back to OpenCV, other errors (e.g. OOM) are real
+                if isinstance(e, torch.cuda.OutOfMemoryError) or \
+                        ('nvjpeg' not in str(e).lower() and 'not supported' not in str(e).lower()):
+                    raise
+
+        image = cv2.imread(str(image_path))
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), None
+
+    def use_gpu_jpeg_decode(self, image_path):
+        if self.jpeg_decode_device is None or Path(image_path).suffix.lower() not in ('.jpg', '.jpeg'):
+            return False
+        # nvJPEG ignores EXIF orientation, while cv2.imread applies it, so rotated JPEGs stay on OpenCV.
+        # Checked once per file, since the header is otherwise read on every load
+        if image_path not in self.gpu_jpeg_decodable:
+            with Image.open(image_path) as image:
+                self.gpu_jpeg_decodable[image_path] = image.getexif().get(0x0112, 1) == 1
+        return self.gpu_jpeg_decodable[image_path]
+
     def __len__(self):
         if self.epoch_len > 0:
             return self.epoch_len
@@ -23,15 +23,16 @@ class DavisDataset(ISDataset):
             self.dataset_samples = [x.name for x in sorted(self._images_path.glob('*.*'))]
 
         self._masks_paths = {x.stem: x for x in self._insts_path.glob('*.*')}
+        if getattr(args, 'gpu_jpeg_decode', False):
+            self.jpeg_decode_device = args.device
 
     def get_sample(self, index) -> DSample:
         image_name = self.dataset_samples[index]
         image_path = str(self._images_path / image_name)
         mask_path = str(self._masks_paths[image_name.split('.')[0]])
 
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image, image_nd = self.load_image_nd(image_path)
         instances_mask = np.max(cv2.imread(mask_path).astype(np.int32), axis=2)
         instances_mask[instances_mask > 0] = 1
 
-        return DSample(image, instances_mask, objects_ids=[1], sample_id=index, imname=image_path)
+        return DSample(image, instances_mask, objects_ids=[1], sample_id=index, imname=image_path, image_nd=image_nd)
@@ -23,6 +23,8 @@ class GrabCutDataset(ISDataset):
             self.dataset_samples = [x.name for x in sorted(self._images_path.glob('*.*'))]
             
         self._masks_paths = {x.stem: x for x in self._insts_path.glob('*.*')}
+        if getattr(args, 'gpu_jpeg_decode', False):
+            self.jpeg_decode_device = args.device
 
     def get_sample(self, index) -> DSample:
 
@@ -30,10 +32,9 @@ class GrabCutDataset(ISDataset):
         image_path = str(self._images_path / image_name)
         mask_path = str(self._masks_paths[image_name.split('.')[0]])
 
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image, image_nd = self.load_image_nd(image_path)
         instances_mask = cv2.imread(mask_path)[:, :, 0].astype(np.int32)
         instances_mask[instances_mask == 128] = -1
         instances_mask[instances_mask > 128] = 1
 
-        return DSample(image, instances_mask, objects_ids=[1], ignore_ids=[-1], sample_id=index, imname=image_path)
\ No newline at end of file
+        return DSample(image, instances_mask, objects_ids=[1], ignore_ids=[-1], sample_id=index, imname=image_path, image_nd=image_nd)
\ No newline at end of file
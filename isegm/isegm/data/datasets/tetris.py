@@ -32,6 +32,8 @@ class TETRISDataset(GrabCutDataset):
     def __init__(self, dataset_path, args, max_side_size=2048, images_dir_name: str = 'images', masks_dir_name: str = 'masks', **kwargs):
         super(TETRISDataset, self).__init__(dataset_path, args, images_dir_name=images_dir_name, masks_dir_name=masks_dir_name, **kwargs)
         self.max_side_size = max_side_size
+        # Images are resized on host after loading, so GPU decoding would only add a round trip over PCIe
+        self.jpeg_decode_device = None
 
     def aligned_resize(self, mask, new_height, new_width):
         mask_resized = np.zeros((new_height, new_width), dtype=mask.dtype)
@@ -49,8 +51,7 @@ class TETRISDataset(GrabCutDataset):
         image_path = self._images_path / image_name
         mask_path = (self._insts_path / image_name).with_suffix('.png')
 
-        image = cv2.imread(str(image_path))
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = self.load_image(image_path)
         instances_mask = cv2.imread(str(mask_path))
         instances_mask = instances_mask.astype(np.int32)
         instances_mask = instances_mask[:, :, 0] * 65536 + instances_mask[:, :, 1] * 256 + instances_mask[:, :, 2]
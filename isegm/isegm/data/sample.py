@@ -7,8 +7,10 @@ from albumentations import ReplayCompose
 
 class DSample:
     def __init__(self, image, encoded_masks, objects=None,
-                 objects_ids=None, ignore_ids=None, sample_id=None, imname=None):
+                 objects_ids=None, ignore_ids=None, sample_id=None, imname=None, image_nd=None):
         self.image = image
+        # Optional (H, W, 3) uint8 copy of the image already on GPU (e.g. decoded with nvJPEG)
+        self.image_nd = image_nd
         self.sample_id = sample_id
         self.imname = imname
         
@@ -46,6 +48,7 @@ class DSample:
         self.reset_augmentation()
         aug_output = augmentator(image=self.image, mask=self._encoded_masks)
         self.image = aug_output['image']
+        self.image_nd = None
         self._encoded_masks = aug_output['mask']
 
         aug_replay = aug_output.get('replay', None)
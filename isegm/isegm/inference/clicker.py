@@ -4,6 +4,41 @@ import cv2
 import torch
 
 
+def filter_clickmap_by_quantiles(click_map, quantile_low, quantile_high):
+    """
+    Zeroes clickmap values outside of [quantile_low, quantile_high] of its cumulative mass.
+    """
+    sorted_clickmap = np.sort(click_map.flatten())
+    quantile_low = sorted_clickmap.sum() * quantile_low
+    quantile_high = sorted_clickmap.sum() * quantile_high
+
+    idx_low = sorted_clickmap.cumsum().searchsorted(quantile_low, side='left')
+    idx_high = sorted_clickmap.cumsum().searchsorted(quantile_high, side='right')
+    if idx_high == len(sorted_clickmap):
+        idx_high -= 1
+
+    thr_low = sorted_clickmap[idx_low]
+    thr_high = sorted_clickmap[idx_high]
+    return click_map * (click_map >= thr_low) * (click_map <= thr_high)
+
+
+def sample_click_coords(probs):
+    """
+    Draws one (y, x) position from a 2D probability map.
+    Same inverse CDF sampling and RNG draw as np.random.choice(probs.size, p=probs.flatten()),
+    without building the index array on every click.
+    """
+    cdf = probs.ravel().astype(np.float64).cumsum()
+    # Same inputs are rejected as by np.random.choice, instead of silently clicking at (0, 0)
+    if not (np.isfinite(cdf[-1]) and cdf[-1] > 0):
+        raise ValueError('probabilities contain NaN or do not sum to a positive number')
+    if np.any(probs < 0):
+        raise ValueError('probabilities are not non-negative')
+    cdf /= cdf[-1]
+    indx = min(cdf.searchsorted(np.random.random_sample(), side='right'), cdf.size - 1)
+    return np.unravel_index(indx, probs.shape)
+
+
 class Clicker(object):
     def __init__(self, gt_mask=None, image=None, init_clicks=None, ignore_label=-1, click_indx_offset=0, 
                  click_model=None, model_device='cuda', quantile_low=0.0, quantile_high=1.0):
@@ -73,19 +108,7 @@ class Clicker(object):
 
                 click_map = self.click_model.apply(self.image, self.gt_mask, fn_mask[1:-1, 1:-1])[0][0].detach().cpu().numpy()
                 self.click_map = click_map * fn_mask[1:-1, 1:-1].astype(np.float32) * self.not_clicked_map
-
-                sorted_clickmap = np.sort(self.click_map.flatten())
-                quantile_low = sorted_clickmap.sum() * self.quantile_low
-                quantile_high = sorted_clickmap.sum() * self.quantile_high
-                
-                idx_low = sorted_clickmap.cumsum().searchsorted(quantile_low, side='left')
-                idx_high = sorted_clickmap.cumsum().searchsorted(quantile_high, side='right')
-                if idx_high == len(sorted_clickmap):
-                    idx_high -= 1
-                
-                thr_low = sorted_clickmap[idx_low]
-                thr_high = sorted_clickmap[idx_high]
-                self.click_map = self.click_map * (self.click_map >= thr_low) * (self.click_map <= thr_high)
+                self.click_map = filter_clickmap_by_quantiles(self.click_map, self.quantile_low, self.quantile_high)
 
                 probs = self.click_map / np.sum(self.click_map)
                 
@@ -95,7 +118,7 @@ class Clicker(object):
                     coords_y = coords_y[0]
                     coords_x = coords_x[0]
                 else:
-                    coords_y, coords_x = np.unravel_index(np.random.choice(np.arange(probs.size), p=probs.flatten()), probs.shape)
+                    coords_y, coords_x = sample_click_coords(probs)
 
             else:
                 self.click_map = fn_mask_dt
@@ -108,19 +131,7 @@ class Clicker(object):
             if self.click_model is not None:
                 click_map = self.click_model.apply(self.image, self.gt_mask, fp_mask[1:-1, 1:-1])[0][0].detach().cpu().numpy()
                 self.click_map = click_map * fp_mask[1:-1, 1:-1].astype(np.float32) * self.not_clicked_map
-
-                sorted_clickmap = np.sort(self.click_map.flatten())
-                quantile_low = sorted_clickmap.sum() * self.quantile_low
-                quantile_high = sorted_clickmap.sum() * self.quantile_high
-                
-                idx_low = sorted_clickmap.cumsum().searchsorted(quantile_low, side='left')
-                idx_high = sorted_clickmap.cumsum().searchsorted(quantile_high, side='right')
-                if idx_high == len(sorted_clickmap):
-                    idx_high -= 1
-                
-                thr_low = sorted_clickmap[idx_low]
-                thr_high = sorted_clickmap[idx_high]
-                self.click_map = self.click_map * (self.click_map >= thr_low) * (self.click_map <= thr_high)
+                self.click_map = filter_clickmap_by_quantiles(self.click_map, self.quantile_low, self.quantile_high)
 
                 probs = self.click_map / np.sum(self.click_map)
                     
@@ -130,7 +141,7 @@ class Clicker(object):
                     coords_y = coords_y[0]
                     coords_x = coords_x[0]
                 else:
-                    coords_y, coords_x = np.unravel_index(np.random.choice(np.arange(probs.size), p=probs.flatten()), probs.shape)
+                    coords_y, coords_x = sample_click_coords(probs)
 
             else:
                 self.click_map = fp_mask_dt
@@ -5,6 +5,7 @@ import torch
 
 from isegm.inference import utils
 from isegm.inference.clicker import Clicker
+from isegm.inference.predictors import BasePredictor
 from joblib import Parallel, delayed
 from rclicks.nets import SegNeXtSaliencyApply
 import json
@@ -56,13 +57,39 @@ except NameError:
     from tqdm import tqdm
 
 
-def evaluate_functor(dataset, predictor, index, click_model, **kwargs):
+class SamplesDataset(torch.utils.data.Dataset):
+    """
+    Exposes dataset.get_sample() through __getitem__, so DataLoader workers
+    can read and decode next samples while the current one is evaluated.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        return self.dataset.get_sample(index)
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def get_samples_loader(dataset, num_workers, seed, prefetch_factor=4):
+    def worker_init_fn(worker_id):
+        np.random.seed(seed + worker_id)
+        torch.manual_seed(seed + worker_id)
+
+    return torch.utils.data.DataLoader(SamplesDataset(dataset), batch_size=None, shuffle=False,
+                                       num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                       worker_init_fn=worker_init_fn)
+
+
+def evaluate_functor(dataset, predictor, index, click_model, sample=None, **kwargs):
 
     setup_deterministic(kwargs['args'].seed)
     
     all_ious = []
     
-    sample = dataset.get_sample(index)
+    if sample is None:
+        sample = dataset.get_sample(index)
     
     for obj_id in sample.objects_ids:
         
@@ -96,14 +123,32 @@ def evaluate_functor(dataset, predictor, index, click_model, **kwargs):
                 continue
 
         _, sample_ious, _ = evaluate_sample(sample.image, gt_mask, predictor, click_model,
-                                            sample_id=index, user_inputs=user_inputs, dataset_name=dataset_name, **kwargs)
+                                            sample_id=index, user_inputs=user_inputs, dataset_name=dataset_name,
+                                            image_nd=sample.image_nd, **kwargs)
         all_ious.append([sample.imname, sample_ious, mask_id])
 
     return all_ious
 
 
-def evaluate_dataset(dataset, predictor, **kwargs):
-    
+def iterate_samples_chunks(dataset, dataset_iterator, samples_loader, chunk_size):
+    samples_iterator = iter(samples_loader) if samples_loader is not None else None
+    chunk = []
+    for index in dataset_iterator:
+        sample = next(samples_iterator) if samples_iterator is not None else dataset.get_sample(index)
+        chunk.append((index, sample))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_dataset(dataset, predictor, samples_chunk_size=1, samples_chunk_callback=None, **kwargs):
+    """
+    samples_chunk_callback, if given, is called with every chunk of samples_chunk_size
+    (index, sample) pairs right before they are evaluated (e.g. to encode their images in one batch).
+    It runs inside the measured time. Not used with n_workers > 1.
+    """
     all_ious = []
     start_time = time()
     dataset_iterator = tqdm(range(len(dataset)), leave=False)
@@ -119,7 +164,17 @@ def evaluate_dataset(dataset, predictor, **kwargs):
         click_model = None
 
 
-    if kwargs['args'].n_workers == 1:
+    prefetch_workers = getattr(kwargs['args'], 'prefetch_workers', 0)
+    if kwargs['args'].n_workers == 1 and (prefetch_workers > 0 or samples_chunk_callback is not None):
+        samples_loader = None
+        if prefetch_workers > 0:
+            samples_loader = get_samples_loader(dataset, prefetch_workers, kwargs['args'].seed)
+        for chunk in iterate_samples_chunks(dataset, dataset_iterator, samples_loader, samples_chunk_size):
+            if samples_chunk_callback is not None:
+                samples_chunk_callback(chunk)
+            for index, sample in chunk:
+                all_ious.append(evaluate_functor(dataset, predictor, index, click_model, sample=sample, **kwargs))
+    elif kwargs['args'].n_workers == 1:
         for index in dataset_iterator:
             all_ious.append(evaluate_functor(dataset, predictor, index, click_model, **kwargs))
     else:
@@ -134,9 +189,31 @@ def evaluate_dataset(dataset, predictor, **kwargs):
 
 
 
+def upload_gt_mask(gt_mask, predictor):
+    # IoU is computed on GPU next to the prediction, if predictor keeps the last prediction there
+    if not isinstance(predictor, BasePredictor) or torch.device(predictor.device).type != 'cuda':
+        return None
+    return torch.from_numpy(gt_mask).to(predictor.device)
+
+
+def get_iou(gt_mask, gt_mask_nd, pred_mask, predictor, pred_thr):
+    if gt_mask_nd is None or predictor.prev_prediction.shape[-2:] != gt_mask_nd.shape:
+        return utils.get_iou(gt_mask, pred_mask)
+    return utils.get_iou_torch(gt_mask_nd, predictor.prev_prediction[0, 0] > pred_thr)
+
+
 def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
                     pred_thr=0.49, min_clicks=1, max_clicks=20,
-                    sample_id=None, callback=None, args=None, user_inputs=None, dataset_name=None):
+                    sample_id=None, callback=None, args=None, user_inputs=None, dataset_name=None,
+                    image_nd=None):
+
+    gt_mask_nd = upload_gt_mask(gt_mask, predictor)
+    # Image decoded on GPU is passed as is, without another upload of the host copy
+    input_image = image_nd if image_nd is not None and isinstance(predictor, BasePredictor) else image
+
+    # Click loops stop as soon as max_iou_thr is reached (NoC evaluation). The IoU is checked
+    # on every click: the Clicker needs the prediction on host each click anyway, so checking
+    # less often would only add forwards without removing a sync.
 
     if user_inputs is not None:
 
@@ -159,7 +236,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
                 clicker = Clicker(image=image)
 
             pred_mask = np.zeros_like(gt_mask)
-            predictor.set_input_image(image)
+            predictor.set_input_image(input_image)
 
             with torch.no_grad():
                 for click_indx in range(max_clicks):
@@ -179,7 +256,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
                     if callback is not None:
                         callback(image, gt_mask, pred_probs, sample_id, click_indx, 
                                  clicker.clicks_list, clickmap)
-                    iou = utils.get_iou(gt_mask, pred_mask)
+                    iou = get_iou(gt_mask, gt_mask_nd, pred_mask, predictor, pred_thr)
                     biou = utils.get_boundary_iou(gt_mask, pred_mask)
                     ious_list.append([iou, biou, user_click])
                     if iou >= max_iou_thr and click_indx + 1 >= min_clicks:
@@ -189,7 +266,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
 
         with torch.no_grad():
             ious_list = []
-            predictor.set_input_image(image)
+            predictor.set_input_image(input_image)
             pred_mask = np.zeros_like(gt_mask)
             clicker = Clicker(gt_mask=gt_mask, image=image, click_model=click_model, 
                               quantile_low=args.trajectory_sampling_prob_low, 
@@ -205,7 +282,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
                     callback(image, gt_mask, pred_probs, sample_id, 
                              click_indx, clicker.clicks_list, clickmap)
 
-                iou = utils.get_iou(gt_mask, pred_mask)
+                iou = get_iou(gt_mask, gt_mask_nd, pred_mask, predictor, pred_thr)
                 biou = utils.get_boundary_iou(gt_mask, pred_mask)
 
                 ious_list.append([iou, biou, click])
@@ -220,7 +297,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
         pred_mask = np.zeros_like(gt_mask)
         ious_list = []
 
-        predictor.set_input_image(image)
+        predictor.set_input_image(input_image)
 
         with torch.no_grad():
 
@@ -235,7 +312,7 @@ def evaluate_sample(image, gt_mask, predictor, click_model, max_iou_thr,
                 if callback is not None:
                     callback(image, gt_mask, pred_probs, sample_id, click_indx, clicker.clicks_list, clickmap)
 
-                iou = utils.get_iou(gt_mask, pred_mask)
+                iou = get_iou(gt_mask, gt_mask_nd, pred_mask, predictor, pred_thr)
                 biou = utils.get_boundary_iou(gt_mask, pred_mask)
 
                 ious_list.append([iou, biou, click])
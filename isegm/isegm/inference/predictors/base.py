@@ -23,6 +23,7 @@ class BasePredictor(object):
         self.model_indx = 0
         self.click_models = None
         self.net_state_dict = None
+        self.copy_stream = None
 
         if isinstance(model, tuple):
             self.net, self.click_models = model
@@ -40,14 +41,38 @@ class BasePredictor(object):
             self.transforms.append(AddHorizontalFlip())
 
     def set_input_image(self, image):
-        image_nd = self.to_tensor(image)
         for transform in self.transforms:
             transform.reset()
-        self.original_image = image_nd.to(self.device)
+        self.original_image = self.upload_image(image)
         if len(self.original_image.shape) == 3:
             self.original_image = self.original_image.unsqueeze(0)
         self.prev_prediction = torch.zeros_like(self.original_image[:, :1, :, :])
 
+    def upload_image(self, image):
+        if isinstance(image, torch.Tensor):
+            # (H, W, 3) uint8 image already decoded on GPU
+            image_nd = image.to(self.device)
+            return image_nd.permute(2, 0, 1).float().div(torch.tensor(255., device=image_nd.device))
+
+        if torch.device(self.device).type != 'cuda' or not isinstance(image, np.ndarray) \
+                or image.dtype != np.uint8 or image.ndim != 3:
+            return self.to_tensor(image).to(self.device)
+
+        # Copy uint8 pixels from pinned memory on a side stream and
+        # convert them on GPU, which is 4x less PCIe traffic than ToTensor output
+        if self.copy_stream is None:
+            self.copy_stream = torch.cuda.Stream(device=self.device)
+        image_pinned = torch.from_numpy(np.ascontiguousarray(image)).pin_memory()
+        with torch.cuda.stream(self.copy_stream):
+            image_nd = image_pinned.to(self.device, non_blocking=True)
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.copy_stream)
+        image_nd.record_stream(current_stream)
+
+        # Divisor is a device tensor: a CPU scalar makes CUDA multiply by 1/255 instead,
+        # which differs from ToTensor's x / 255 by one ulp for about half of the byte values
+        return image_nd.permute(2, 0, 1).float().div(torch.tensor(255., device=image_nd.device))
+
     def get_prediction(self, clicker, prev_mask=None):
         clicks_list = clicker.get_clicks()
 
@@ -67,8 +92,12 @@ class BasePredictor(object):
         )
 
         pred_logits = self._get_prediction(image_nd, clicks_lists, is_image_changed)
-        prediction = F.interpolate(pred_logits, mode='bilinear', align_corners=True,
-                                   size=image_nd.size()[2:])
+        if pred_logits.shape[2:] == image_nd.shape[2:]:
+            # Identity resize, e.g. SAM already returns masks in the input resolution
+            prediction = pred_logits
+        else:
+            prediction = F.interpolate(pred_logits, mode='bilinear', align_corners=True,
+                                       size=image_nd.size()[2:])
 
         for t in reversed(self.transforms):
             prediction = t.inv_transform(prediction)
@@ -66,6 +66,15 @@ def get_dataset(dataset_name, cfg, args):
     else:
         dataset = None
 
+    if dataset is not None:
+        # Datasets are built once and reused for every checkpoint, so the samples index is made immutable
+        dataset.dataset_samples = tuple(dataset.dataset_samples)
+        # Decoded images are kept in RAM and / or mirrored to a local (e.g. /dev/shm) directory
+        if getattr(args, 'cache_images', False):
+            dataset.images_cache = {}
+        dataset.images_cache_dir = getattr(args, 'images_cache_path', None)
+        dataset.images_cache_dir_limit = int(getattr(args, 'images_cache_max_gb', 50) * 2 ** 30)
+
     return dataset
 
 
@@ -79,6 +88,18 @@ def get_iou(gt_mask, pred_mask, ignore_label=-1):
     return intersection / union
 
 
+def get_iou_torch(gt_mask, pred_mask, ignore_label=-1):
+    ignore_gt_mask_inv = gt_mask != ignore_label
+    obj_gt_mask = gt_mask == 1
+
+    # Object pixels are never ignored, so intersection does not need the ignore mask
+    intersection = torch.logical_and(pred_mask, obj_gt_mask).sum()
+    union = torch.logical_and(torch.logical_or(pred_mask, obj_gt_mask), ignore_gt_mask_inv).sum()
+
+    # Single device sync per call; ratio in float64 as in get_iou
+    return (intersection.double() / union.double()).item()
+
+
 def mask_to_boundary(mask, dilation_ratio=0.02):
     """
     Convert binary mask to boundary mask.
@@ -1,8 +1,12 @@
+import hashlib
+from pathlib import Path
+
 import torch
 import torch.nn as nn
 import numpy as np
 import cv2
 from isegm.model.modifiers import LRMult
+from isegm.utils.misc import save_npy_atomic
 from isegm.inference import utils
 from copy import deepcopy
 from segment_anything import SamPredictor, sam_model_registry
@@ -20,6 +24,79 @@ def get_preprocess_shape(oldh: int, oldw: int, long_side_length: int):
         return (newh, neww)
 
 
+def get_image_hash(image):
+    """
+    Hashes uint8 (H, W, 3) pixels of an image, as a numpy array or tensor on any device.
+    Float images are not hashed, since their values may differ across devices by rounding.
+    """
+    if isinstance(image, torch.Tensor):
+        image = image.cpu().numpy()
+    assert image.dtype == np.uint8
+    return hashlib.sha1(np.ascontiguousarray(image).tobytes()).hexdigest()
+
+
+def to_uint8_image(image):
+    # (1, 3, H, W) image in [0, 1] back to its (H, W, 3) uint8 pixels; exact, as rounding error is far below 0.5
+    return image[0].mul(255).round().to(torch.uint8).permute(1, 2, 0)
+
+
+class CUDAGraphMaskDecoder(nn.Module):
+    """
+    Wraps SAM mask decoder and replays it from a captured CUDA graph.
+    A graph is captured once for every distinct set of input shapes.
+    """
+    def __init__(self, mask_decoder, n_warmup=3):
+        super().__init__()
+        self.mask_decoder = mask_decoder
+        self.n_warmup = n_warmup
+        self.graphs = {}
+
+    def forward(self, image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings, multimask_output):
+        inputs = (image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings)
+        key = tuple((x.shape, x.dtype) for x in inputs) + (multimask_output,)
+        if key not in self.graphs:
+            self.graphs[key] = self.capture(inputs, multimask_output)
+
+        graph, static_inputs, static_outputs = self.graphs[key]
+        for static_x, x in zip(static_inputs, inputs):
+            static_x.copy_(x)
+        graph.replay()
+
+        # Static outputs are overwritten by the next replay
+        return tuple(x.clone() for x in static_outputs)
+
+    def capture(self, inputs, multimask_output):
+        static_inputs = [x.clone() for x in inputs]
+
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.n_warmup):
+                self.mask_decoder(*static_inputs, multimask_output=multimask_output)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_outputs = self.mask_decoder(*static_inputs, multimask_output=multimask_output)
+
+        return graph, static_inputs, static_outputs
+
+
+class Int8Linear(nn.Module):
+    """
+    Runs a bitsandbytes int8 linear layer on inputs of any rank.
+    SAM ViT blocks call linear layers on (B, H, W, C) activations, while int8 matmul
+    handles only 2D and 3D inputs, so inputs are flattened to 2D fp16 and reshaped back.
+    """
+    def __init__(self, int8_linear):
+        super().__init__()
+        self.int8_linear = int8_linear
+
+    def forward(self, x):
+        output = self.int8_linear(x.reshape(-1, x.shape[-1]).half())
+        return output.to(x.dtype).reshape(*x.shape[:-1], output.shape[-1])
+
+
 class ISModelSAM(nn.Module):
     def __init__(self, device='cuda', model_path=None):
         super().__init__()
@@ -34,6 +111,14 @@ class ISModelSAM(nn.Module):
         self.resize = ResizeLongestSide(sam.image_encoder.img_size)
         self.with_prev_mask = True
         self.binary_prev_mask = False
+        self.bf16_encoder = False
+        self.cached_image = None
+        self.embeddings = None
+        self.embeddings_cache_dir = None
+        self.n_points_pad = None
+        self.prompts_cpu = None
+        self.prompts_gpu = None
+        self.prompts_copied = None
 
     
     def forward(self, image, points):
@@ -45,9 +130,10 @@ class ISModelSAM(nn.Module):
         
         image, prev_mask = self.prepare_input(image)
 
-        input_image = self.resize.apply_image_torch(image * 255)
-           
-        self.sam_predictor.set_torch_image(input_image, image.shape[2:])
+        # Image embedding depends only on the image, so encoder runs once per sample
+        if not self.is_image_cached(image):
+            self.set_image(image)
+            self.cached_image = image
 
         points_list = []
         for idx in range(points.shape[1]):
@@ -70,8 +156,15 @@ class ISModelSAM(nn.Module):
         points_list = points_list.astype(float)
         points_list[..., 0] = points_list[..., 0] * (new_w / old_w)
         points_list[..., 1] = points_list[..., 1] * (new_h / old_h)
-        points_list = torch.as_tensor(points_list, dtype=torch.float, device=self.sam_predictor.device)[None]
-        input_label = torch.tensor(input_label)[None].to(self.sam_predictor.device)
+        if self.n_points_pad is not None:
+            # Constant prompt shape for the decoder. SAM embeds every point labeled -1 as a 'not a point'
+            # token which takes part in decoder attention, so padding changes predictions
+            assert len(input_label) <= self.n_points_pad
+            n_pad = self.n_points_pad - len(input_label)
+            points_list = np.concatenate([points_list, np.zeros((n_pad, 2))], axis=0)
+            input_label = input_label + [-1] * n_pad
+
+        points_list, input_label = self.upload_prompts(points_list, input_label)
 
         res, scores, logits = self.sam_predictor.predict_torch(
                     point_coords=points_list,
@@ -80,17 +173,106 @@ class ISModelSAM(nn.Module):
                     multimask_output=True,
                     return_logits=True)
 
-        prediction = torch.sigmoid(res)
-        prediction = prediction[0, torch.argmax(scores)][None, None]
+        # Sigmoid only for the selected mask, not for all multimask outputs
+        best_indx = torch.argmax(scores[0])
+        prediction = torch.sigmoid(res[0, best_indx])[None, None]
 
         # Since SAM use its own prev mask format
-        self.prev_mask = logits[0, torch.argmax(scores)][None, None]
+        # (cloned, since compiled decoder may reuse its output buffers on the next call)
+        self.prev_mask = logits[0, best_indx][None, None].clone()
         
         outputs = {'instances':  prediction}
         
         return outputs
 
 
+    def set_image(self, image):
+        input_image = self.resize.apply_image_torch(image * 255)
+
+        features, cache_path = None, None
+        if self.embeddings is not None or self.embeddings_cache_dir is not None:
+            image_hash = get_image_hash(to_uint8_image(image))
+            if self.embeddings is not None:
+                features = self.embeddings.get(image_hash)
+            if features is None and self.embeddings_cache_dir is not None:
+                cache_path = Path(self.embeddings_cache_dir) / f'{image_hash}.npy'
+                if cache_path.exists():
+                    features = torch.from_numpy(np.load(cache_path))
+
+        if features is not None:
+            self.sam_predictor.reset_image()
+            self.sam_predictor.original_size = image.shape[2:]
+            self.sam_predictor.input_size = tuple(input_image.shape[-2:])
+            self.sam_predictor.features = features.to(self.sam_predictor.device)
+            self.sam_predictor.is_image_set = True
+            return
+
+        if self.bf16_encoder:
+            input_image = input_image.contiguous(memory_format=torch.channels_last)
+        with torch.cuda.nvtx.range('sam_image_encoder'), \
+                torch.autocast('cuda', dtype=torch.bfloat16, enabled=self.bf16_encoder):
+            self.sam_predictor.set_torch_image(input_image, image.shape[2:])
+        # Prompt encoder and mask decoder always run in fp32. Cloned, since a compiled encoder
+        # returns graph-owned memory that may be reused by decoder calls for the next clicks
+        self.sam_predictor.features = self.sam_predictor.features.float().clone()
+
+        if cache_path is not None:
+            save_npy_atomic(cache_path, self.sam_predictor.features.cpu().numpy())
+
+
+    def upload_prompts(self, points_list, input_label):
+        """
+        Copies point coords and labels to device through persistent pinned and device buffers,
+        instead of allocating new tensors on every click. Returns (1, N, 2) coords and (1, N) labels.
+        """
+        n_points = len(input_label)
+        device = torch.device(self.sam_predictor.device)
+        if self.prompts_cpu is None or self.prompts_cpu.shape[0] < n_points:
+            n_alloc = max(n_points, self.n_points_pad or 0, 32)
+            self.prompts_cpu = torch.zeros(n_alloc, 3, pin_memory=device.type == 'cuda')
+            self.prompts_gpu = torch.zeros(n_alloc, 3, device=device)
+            self.prompts_copied = None
+
+        # Previous asynchronous copy must finish before its source is overwritten
+        if self.prompts_copied is not None:
+            self.prompts_copied.synchronize()
+        self.prompts_cpu[:n_points, :2] = torch.from_numpy(np.asarray(points_list, dtype=np.float32))
+        self.prompts_cpu[:n_points, 2] = torch.from_numpy(np.asarray(input_label, dtype=np.float32))
+        self.prompts_gpu[:n_points].copy_(self.prompts_cpu[:n_points], non_blocking=True)
+        if device.type == 'cuda':
+            self.prompts_copied = torch.cuda.Event()
+            self.prompts_copied.record()
+
+        return self.prompts_gpu[None, :n_points, :2], self.prompts_gpu[None, :n_points, 2]
+
+
+    def encode_images(self, images):
+        """
+        Runs image encoder on a batch of (1, 3, H, W) images in [0, 1] range.
+        Images are resized and padded as in set_image, so their sizes may differ.
+        """
+        sam = self.sam_predictor.model
+        input_images = [sam.preprocess(self.resize.apply_image_torch(image.to(self.sam_predictor.device) * 255))
+                        for image in images]
+        input_images = torch.cat(input_images, dim=0)
+        if self.bf16_encoder:
+            input_images = input_images.contiguous(memory_format=torch.channels_last)
+        with torch.cuda.nvtx.range('sam_image_encoder'), \
+                torch.autocast('cuda', dtype=torch.bfloat16, enabled=self.bf16_encoder):
+            features = sam.image_encoder(input_images)
+
+        # Cloned for the same reason as in set_image
+        return features.float().clone()
+
+
+    def is_image_cached(self, image):
+        if self.cached_image is None or not self.sam_predictor.is_image_set:
+            return False
+        if self.cached_image.shape != image.shape:
+            return False
+        return self.cached_image is image or torch.equal(self.cached_image, image)
+
+
     def prepare_input(self, image):
         prev_mask = None
         if self.with_prev_mask:
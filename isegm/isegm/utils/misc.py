@@ -1,3 +1,8 @@
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+
 import torch
 import numpy as np
 
@@ -148,3 +153,30 @@ def get_labels_with_sizes(x):
     labels = np.nonzero(obj_sizes)[0].tolist()
     labels = [x for x in labels if x != 0]
     return labels, obj_sizes[labels].tolist()
+
+
+def file_cache_key(path, *extra):
+    """
+    Hex key of a file for on-disk caches: resolved path, size and mtime (so that a changed
+    or another file with the same name gets a new key) and any extra settings the cached data depends on.
+    """
+    stat = os.stat(path)
+    key = ':'.join(map(str, (Path(path).resolve(), stat.st_size, stat.st_mtime_ns) + extra))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def save_npy_atomic(path, array):
+    """
+    Saves array so that readers never see a partially written file, also when several
+    processes write the same path: each writer uses its own temporary file, then renames it.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp.npy', delete=False) as f:
+        try:
+            np.save(f, array)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
@@ -17,7 +17,7 @@ from evaluate_model_ritm import get_checkpoints_list_and_logs_path, save_results
 
 
 def main():
-    args, cfg = parse_args()
+    args, cfg = parse_args(sam_only_options=False)
 
     checkpoints_list, logs_path, logs_prefix = get_checkpoints_list_and_logs_path(args, cfg)
     logs_path.mkdir(parents=True, exist_ok=True)
@@ -13,6 +13,7 @@ from isegm.utils.exp import load_config_file
 from isegm.utils.vis import draw_probmap, draw_with_blend_and_clicks
 from isegm.inference.predictors import get_predictor
 from isegm.inference.evaluation import evaluate_dataset
+from isegm.inference.clicker import Click
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -56,6 +57,8 @@ def parse_args():
     parser.add_argument('--eval-mode', type=str, default='cvpr',
                         help='Possible choices: cvpr, fixed<number> (e.g. fixed400, fixed600).')
     parser.add_argument('--save-ious', action='store_true', default=False)
+    parser.add_argument('--results-format', type=str, choices=['pkl', 'h5'], default='pkl',
+                        help='File format of per-click IoUs saved with --save-ious.')
     parser.add_argument('--print-ious', action='store_true', default=False)
     parser.add_argument('--vis-preds', action='store_true', default=False)
     parser.add_argument('--model-name', type=str, default=None,
@@ -74,6 +77,7 @@ def parse_args():
     parser.add_argument('--trajectory_sampling_prob_high', type=float, default=1.0, help='Sampling from clickmap with prob <=')
 
     args = parser.parse_args()
+    check_results_format(parser, args)
     
     if args.cpu:
         args.device = torch.device('cpu')
@@ -243,8 +247,12 @@ def save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_r
     if save_ious:
         ious_path = logs_path / 'ious' / (logs_prefix if logs_prefix else '')
         ious_path.mkdir(parents=True, exist_ok=True)
-        with open(ious_path / f'{dataset_name}_{args.eval_mode}_{args.mode}_{args.n_clicks}.pkl', 'wb') as fp:
-            pickle.dump(all_ious, fp)
+        ious_name = f'{dataset_name}_{args.eval_mode}_{args.mode}_{args.n_clicks}'
+        if getattr(args, 'results_format', 'pkl') == 'h5':
+            save_ious_h5(ious_path / f'{ious_name}.h5', all_ious)
+        else:
+            with open(ious_path / f'{ious_name}.pkl', 'wb') as fp:
+                pickle.dump(all_ious, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
     name_prefix = ''
     if logs_prefix:
@@ -263,6 +271,44 @@ def save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_r
             f.write(table_row + '\n')
 
 
+def check_results_format(parser, args):
+    # Fail before evaluation rather than when saving results at the very end
+    if args.results_format == 'h5':
+        try:
+            import h5py
+        except ImportError:
+            parser.error('--results-format h5 requires h5py (pip install h5py)')
+
+
+def save_ious_h5(h5_path, all_ious):
+    """
+    Stores per-click IoUs of all samples as flat arrays:
+    ious[offsets[i]:offsets[i + 1]] holds (IoU, boundary IoU) of i-th sample,
+    clicks holds (y, x, is_positive) of the same clicks (is_positive is NaN if unknown).
+    """
+    import h5py
+
+    def get_click_row(click):
+        if isinstance(click, Click):
+            return (*click.coords, click.is_positive)
+        elif isinstance(click, tuple):
+            return (*click, np.nan)
+        else:
+            # Real-users clicks are positive clicks in (x, y) format
+            return (click[1], click[0], True)
+
+    lengths = [len(sample_ious) for sample_ious in all_ious]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    ious = np.array([row[:2] for sample_ious in all_ious for row in sample_ious], dtype=np.float32).reshape(-1, 2)
+    clicks = np.array([get_click_row(row[2]) for sample_ious in all_ious for row in sample_ious],
+                      dtype=np.float32).reshape(-1, 3)
+
+    with h5py.File(h5_path, 'w') as f:
+        f.create_dataset('ious', data=ious, chunks=True, compression='lzf')
+        f.create_dataset('clicks', data=clicks, chunks=True, compression='lzf')
+        f.create_dataset('offsets', data=offsets)
+
+
 def save_iou_analysis_data(args, dataset_name, logs_path, logs_prefix, dataset_results, model_name=None):
     all_ious, _ = dataset_results
 
@@ -1,7 +1,9 @@
+import re
 import sys
 import pickle
 import argparse
 from pathlib import Path
+from itertools import product
 
 import cv2
 import torch
@@ -10,12 +12,18 @@ import numpy as np
 sys.path.insert(0, '.')
 from isegm.inference import utils
 from isegm.utils.exp import load_config_file
+from isegm.utils.misc import file_cache_key
 from isegm.inference.predictors import get_predictor
 from isegm.inference.evaluation import evaluate_dataset
-from isegm.model.is_sam_model import ISModelSAM
-from evaluate_model_ritm import get_checkpoints_list_and_logs_path, save_results, save_iou_analysis_data, get_prediction_vis_callback
+from isegm.model.is_sam_model import ISModelSAM, CUDAGraphMaskDecoder, Int8Linear, get_image_hash
+from evaluate_model_ritm import get_checkpoints_list_and_logs_path, save_results, save_iou_analysis_data, get_prediction_vis_callback, \
+    check_results_format
 
-def parse_args():
+def parse_args(sam_only_options=True):
+    """
+    sam_only_options=False is used by SAM-HQ and MobileSAM scripts, which share this parser
+    but evaluate on a single device without the SAM speed-ups, so those options are rejected.
+    """
     parser = argparse.ArgumentParser()
 
     parser.add_argument('mode', choices=['NoBRS'], help='')
@@ -36,7 +44,8 @@ def parse_args():
 
     group_device = parser.add_mutually_exclusive_group()
     group_device.add_argument('--gpus', type=str, default='0',
-                              help='ID of used GPU.')
+                              help='IDs of used GPUs, separated by a comma. '
+                                   '(dataset, checkpoint) pairs are split between them')
     group_device.add_argument('--cpu', action='store_true', default=False,
                               help='Use only CPU for inference.')
 
@@ -56,6 +65,8 @@ def parse_args():
     parser.add_argument('--eval-mode', type=str, default='cvpr',
                         help='Possible choices: cvpr, fixed<number> (e.g. fixed400, fixed600).')
     parser.add_argument('--save-ious', action='store_true', default=False)
+    parser.add_argument('--results-format', type=str, choices=['pkl', 'h5'], default='pkl',
+                        help='File format of per-click IoUs saved with --save-ious.')
     parser.add_argument('--print-ious', action='store_true', default=False)
     parser.add_argument('--vis-preds', action='store_true', default=False)
     parser.add_argument('--model-name', type=str, default=None,
@@ -67,6 +78,11 @@ def parse_args():
 
     parser.add_argument('--minimize', action='store_true', default=False, help='Minimization of iou during optimization')
     parser.add_argument('--n_workers', type=int, default=1, help='Number of parallel workers on inference')
+    parser.add_argument('--prefetch_workers', type=int, default=0, help='Number of DataLoader workers reading samples ahead (with --n_workers=1)')
+    parser.add_argument('--gpu_jpeg_decode', action='store_true', default=False, help='Decode JPEG images of datasets on GPU with nvJPEG (EXIF-rotated JPEGs are still read with OpenCV)')
+    parser.add_argument('--cache_images', action='store_true', default=False, help='Keep decoded dataset images in RAM, so that next checkpoints read no images from disk')
+    parser.add_argument('--images_cache_path', type=str, default=None, help='Mirror decoded dataset images to this local directory (e.g. /dev/shm/rclicks_images)')
+    parser.add_argument('--images_cache_max_gb', type=float, default=50, help='Size limit of --images_cache_path, images beyond it are decoded every time')
     parser.add_argument('--n_samples', type=int, default=0, help='Slice only N samples from dataset (for debug only)')
     parser.add_argument('--clickability_model_pth', type=str, default=None, help='Path to clickability model')
     parser.add_argument('--user_inputs', action='store_true', default=False, help='Use user inputs mode (if clickability_model_pth specified, we sample exact number of clicks as users, otherwise use real-users clicks)')
@@ -74,7 +90,46 @@ def parse_args():
     parser.add_argument('--trajectory_sampling_prob_low', type=float, default=0.0, help='Sampling from clickmap with prob >=')
     parser.add_argument('--trajectory_sampling_prob_high', type=float, default=1.0, help='Sampling from clickmap with prob <=')
 
+    group_graph = parser.add_mutually_exclusive_group()
+    group_graph.add_argument('--compile', action='store_true', default=False,
+                             help='Compile SAM image encoder and mask decoder with torch.compile (mode="reduce-overhead").')
+    group_graph.add_argument('--cuda-graph', action='store_true', default=False,
+                             help='Capture SAM mask decoder into a CUDA graph and replay it on every click.')
+    parser.add_argument('--pad-prompts', action='store_true', default=False,
+                        help='Pad SAM point prompts to --clicks-limit (or --n-clicks) points labeled -1, so that the decoder '
+                             'always sees one input shape. CHANGES RESULTS: SAM adds a "not a point" token per padding '
+                             'point, so IoU/NoC are not comparable with runs without this flag.')
+    group_precision = parser.add_mutually_exclusive_group()
+    group_precision.add_argument('--bf16', action='store_true', default=False,
+                                 help='Run SAM image encoder under bfloat16 autocast with channels-last weights.')
+    group_precision.add_argument('--int8', action='store_true', default=False,
+                                 help='Quantize linear layers of SAM image encoder to int8 (requires bitsandbytes). '
+                                      'Check IoU against the fp32 run before relying on it.')
+    parser.add_argument('--emb-cache-path', type=str, default=None,
+                        help='Directory to keep SAM image embeddings between runs (one subdirectory per checkpoint). '
+                             'Disabled by default.')
+    parser.add_argument('--encoder-batch', type=int, default=1,
+                        help='Encode images of this many next samples in one SAM image encoder batch before their clicks '
+                             '(with --n_workers=1). Encoding time is included in SPC.')
+
     args = parser.parse_args()
+    check_results_format(parser, args)
+    if not sam_only_options:
+        sam_only_args = {'--compile': args.compile, '--cuda-graph': args.cuda_graph, '--pad-prompts': args.pad_prompts,
+                         '--bf16': args.bf16, '--int8': args.int8, '--emb-cache-path': args.emb_cache_path is not None,
+                         '--encoder-batch': args.encoder_batch > 1, '--gpus with several IDs': ',' in args.gpus}
+        used_args = [name for name, is_used in sam_only_args.items() if is_used]
+        if used_args:
+            parser.error(f'{", ".join(used_args)} supported only by evaluate_model_sam.py')
+    if args.gpu_jpeg_decode and (args.cpu or args.prefetch_workers > 0 or args.n_workers > 1):
+        parser.error('--gpu_jpeg_decode requires GPU and is not supported with prefetch or parallel workers')
+    if args.cache_images and (args.prefetch_workers > 0 or args.n_workers > 1):
+        # Worker processes would fill their own copies of the cache and drop them after every checkpoint
+        parser.error('--cache_images is not supported with prefetch or parallel workers, use --images_cache_path')
+    if args.int8:
+        check_bitsandbytes(parser)
+    if args.encoder_batch > 1 and args.n_workers > 1:
+        parser.error('--encoder-batch is not supported with parallel workers')
     if args.cpu:
         args.device = torch.device('cpu')
     else:
@@ -99,53 +154,210 @@ def parse_args():
 def main():
     args, cfg = parse_args()
 
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
     checkpoints_list, logs_path, logs_prefix = get_checkpoints_list_and_logs_path(args, cfg)
     logs_path.mkdir(parents=True, exist_ok=True)
 
     single_model_eval = len(checkpoints_list) == 1
     assert not args.iou_analysis if not single_model_eval else True, \
         "Can't perform IoU analysis for multiple checkpoints"
+
+    work_list = list(product(args.datasets.split(','), checkpoints_list))
+    gpu_ids = [] if args.cpu else args.gpus.split(',')
+
+    # Each GPU gets its own process and a disjoint subset of (dataset, checkpoint) pairs
+    if len(gpu_ids) > 1:
+        manager = torch.multiprocessing.Manager()
+        results = manager.dict()
+        torch.multiprocessing.spawn(evaluate_worker, nprocs=len(gpu_ids),
+                                    args=(args, cfg, work_list, gpu_ids, logs_path, results))
+    else:
+        results = {}
+        evaluate_worker(0, args, cfg, work_list, gpu_ids, logs_path, results)
+
     print_header = single_model_eval
-    for dataset_name in args.datasets.split(','):
-        dataset = utils.get_dataset(dataset_name, cfg, args)
-
-        for checkpoint_path in checkpoints_list:
-            model = ISModelSAM(device='cuda', model_path=checkpoint_path)
-
-            predictor_params, zoomin_params = get_predictor_and_zoomin_params(args, dataset_name)
-            predictor = get_predictor(model, args.mode, args.device,
-                                      prob_thresh=args.thresh,
-                                      predictor_params=predictor_params,
-                                      zoom_in_params=zoomin_params, with_flip=False, model_name='sam')
-
-            vis_callback = get_prediction_vis_callback(logs_path, dataset_name, args.thresh) if args.vis_preds else None
-            dataset_results = evaluate_dataset(dataset, predictor, pred_thr=args.thresh,
-                                               max_iou_thr=args.target_iou,
-                                               min_clicks=args.min_n_clicks,
-                                               max_clicks=args.n_clicks,
-                                               callback=vis_callback, args=args)
-
-            row_name = args.mode if single_model_eval else checkpoint_path.stem
-            if args.iou_analysis:
-                save_iou_analysis_data(args, dataset_name, logs_path,
-                                       logs_prefix, dataset_results,
-                                       model_name=args.model_name)
-
-            save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_results,
-                         save_ious=single_model_eval and args.save_ious,
-                         single_model_eval=single_model_eval,
-                         print_header=print_header)
-            
-            print_header = False
+    for indx, (dataset_name, checkpoint_path) in enumerate(work_list):
+        dataset_results = results[indx]
+
+        row_name = args.mode if single_model_eval else checkpoint_path.stem
+        if args.iou_analysis:
+            save_iou_analysis_data(args, dataset_name, logs_path,
+                                   logs_prefix, dataset_results,
+                                   model_name=args.model_name)
+
+        save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_results,
+                     save_ious=single_model_eval and args.save_ious,
+                     single_model_eval=single_model_eval,
+                     print_header=print_header)
+
+        print_header = False
+
+
+def evaluate_worker(rank, args, cfg, work_list, gpu_ids, logs_path, results):
+    n_procs = max(1, len(gpu_ids))
+    if len(gpu_ids) > 1:
+        args.device = torch.device(f'cuda:{gpu_ids[rank]}')
+        torch.cuda.set_device(args.device)
+
+    # Contiguous chunks of the dataset-major work list, so that each worker builds as few datasets as possible
+    worker_indices = np.array_split(np.arange(len(work_list)), n_procs)[rank].tolist()
+    dataset_names = list(dict.fromkeys(work_list[indx][0] for indx in worker_indices))
+    datasets = {dataset_name: utils.get_dataset(dataset_name, cfg, args) for dataset_name in dataset_names}
+    for dataset_name, dataset in datasets.items():
+        assert dataset is not None, f"Unknown dataset: {dataset_name}"
+
+    for indx in worker_indices:
+        dataset_name, checkpoint_path = work_list[indx]
+        results[indx] = evaluate_one(args, datasets[dataset_name], dataset_name, checkpoint_path, logs_path)
+
+        # Release image embeddings of the finished pair
+        torch.cuda.empty_cache()
+
+
+def evaluate_one(args, dataset, dataset_name, checkpoint_path, logs_path):
+    model = ISModelSAM(device='cuda', model_path=checkpoint_path)
+    if args.bf16:
+        model.bf16_encoder = True
+        model.sam_predictor.model.image_encoder.to(memory_format=torch.channels_last)
+    if args.int8:
+        quantize_encoder_int8(model)
+    if args.cuda_graph:
+        sam = model.sam_predictor.model
+        sam.mask_decoder = CUDAGraphMaskDecoder(sam.mask_decoder)
+
+    predictor_params, zoomin_params = get_predictor_and_zoomin_params(args, dataset_name)
+    if args.pad_prompts:
+        model.n_points_pad = predictor_params['net_clicks_limit']
+
+    with torch.inference_mode():
+        if args.compile:
+            compile_sam_model(model, predictor_params['net_clicks_limit'])
+        if args.emb_cache_path is not None:
+            model.embeddings_cache_dir = get_embeddings_cache_dir(args, checkpoint_path)
+
+        predictor = get_predictor(model, args.mode, args.device,
+                                  prob_thresh=args.thresh,
+                                  predictor_params=predictor_params,
+                                  zoom_in_params=zoomin_params, with_flip=False, model_name='sam')
+
+        vis_callback = get_prediction_vis_callback(logs_path, dataset_name, args.thresh) if args.vis_preds else None
+        # Images of the next encoder_batch samples are encoded together right before their clicks
+        encode_chunk = (lambda chunk: encode_samples_chunk(model, chunk)) if args.encoder_batch > 1 else None
+        dataset_results = evaluate_dataset(dataset, predictor, pred_thr=args.thresh,
+                                           max_iou_thr=args.target_iou,
+                                           min_clicks=args.min_n_clicks,
+                                           max_clicks=args.n_clicks,
+                                           callback=vis_callback, args=args,
+                                           samples_chunk_size=args.encoder_batch,
+                                           samples_chunk_callback=encode_chunk)
+        model.embeddings = None
+
+    return dataset_results
+
+
+def compile_sam_model(model, max_points, n_warmup=2):
+    sam = model.sam_predictor.model
+    sam.image_encoder = torch.compile(sam.image_encoder, mode='reduce-overhead', fullgraph=False, dynamic=False)
+    sam.mask_decoder = torch.compile(sam.mask_decoder, mode='reduce-overhead', fullgraph=False, dynamic=False)
+    # Decoder is specialized for every number of prompt points, up to max_points of them
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, max_points + 1)
+
+    # Run dummy clicks for every number of points, so that Inductor codegen and graph capture
+    # happen before the evaluation timer starts
+    img_size = model.resize.target_length
+    device = model.sam_predictor.device
+    dummy_image = torch.zeros(1, 4, img_size, img_size, device=device)
+    with torch.no_grad():
+        for n_points in range(1, max_points + 1):
+            dummy_points = [[img_size // 2, img_size // 2, indx] for indx in range(n_points)]
+            dummy_points = torch.tensor([dummy_points + [[-1, -1, -1]] * n_points], device=device)
+            for _ in range(n_warmup):
+                if n_points == 1:
+                    # Otherwise the image is cached after the first call and the encoder is warmed up only once
+                    model.cached_image = None
+                model(dummy_image, dummy_points)
+    model.prev_mask = None
+    model.cached_image = None
+
+    return model
+
+
+BITSANDBYTES_MIN_VERSION = (0, 41, 1)
+
+
+def check_bitsandbytes(parser):
+    try:
+        import bitsandbytes as bnb
+    except ImportError:
+        parser.error('--int8 requires bitsandbytes (pip install "bitsandbytes>=0.41.1")')
+    version = tuple(int(x) for x in re.findall(r'\d+', bnb.__version__)[:3])
+    if version < BITSANDBYTES_MIN_VERSION:
+        parser.error(f'--int8 requires bitsandbytes>=0.41.1, found {bnb.__version__}')
+
+
+def quantize_encoder_int8(model):
+    """
+    Replaces nn.Linear layers of the image encoder (qkv, projections, MLP) with bitsandbytes int8 layers.
+    LayerNorm, softmax and convolutions (patch embedding, neck) are kept as is.
+    """
+    import bitsandbytes as bnb
+
+    image_encoder = model.sam_predictor.model.image_encoder
+    device = model.sam_predictor.device
+    linear_layers = [(name, module) for name, module in image_encoder.named_modules()
+                     if isinstance(module, torch.nn.Linear)]
+    for name, linear in linear_layers:
+        int8_linear = bnb.nn.Linear8bitLt(linear.in_features, linear.out_features, bias=linear.bias is not None,
+                                          has_fp16_weights=False, threshold=6.0)
+        int8_linear.weight = bnb.nn.Int8Params(linear.weight.data.cpu(), requires_grad=False, has_fp16_weights=False)
+        if linear.bias is not None:
+            int8_linear.bias = torch.nn.Parameter(linear.bias.data.half().cpu(), requires_grad=False)
+        # Weights are quantized when moved to GPU
+        int8_linear.to(device)
+
+        parent_name, _, child_name = name.rpartition('.')
+        parent = image_encoder.get_submodule(parent_name) if parent_name else image_encoder
+        setattr(parent, child_name, Int8Linear(int8_linear))
+
+    return model
+
+
+def encode_samples_chunk(model, chunk):
+    """
+    Encodes images of a chunk of (index, sample) pairs in one batch. Only embeddings of the
+    current chunk are kept (on GPU), keyed on uint8 pixels, which ISModelSAM.set_image recovers exactly.
+    """
+    device = model.sam_predictor.device
+    images = []
+    for _, sample in chunk:
+        if sample.image_nd is not None:
+            image_nd = sample.image_nd.to(device)
+        else:
+            image_nd = torch.from_numpy(np.ascontiguousarray(sample.image)).to(device)
+        images.append(image_nd.permute(2, 0, 1).float().div(torch.tensor(255., device=device))[None])
+
+    features = model.encode_images(images)
+    model.embeddings = {get_image_hash(sample.image): image_features[None]
+                        for (_, sample), image_features in zip(chunk, features)}
+
+
+def get_embeddings_cache_dir(args, checkpoint_path):
+    # Embeddings depend on encoder weights and precision, not only on the image.
+    # Stem alone is not enough, since names like 'last_checkpoint' repeat between experiments
+    cache_name = f'{Path(checkpoint_path).stem}_{file_cache_key(checkpoint_path)[:16]}'
+    cache_name += '_bf16' if args.bf16 else '_int8' if args.int8 else ''
+    return Path(args.emb_cache_path) / cache_name
 
 
 def get_predictor_and_zoomin_params(args, dataset_name):
     predictor_params = {}
 
-    if args.clicks_limit is not None:
-        if args.clicks_limit == -1:
-            args.clicks_limit = args.n_clicks
-        predictor_params['net_clicks_limit'] = args.clicks_limit
+    if args.clicks_limit == -1:
+        args.clicks_limit = args.n_clicks
+    # Always bounded, so that the number of prompt points (compiled shapes, padded length) is known
+    predictor_params['net_clicks_limit'] = args.clicks_limit or args.n_clicks
 
     # SAM does not use Zoomin
     zoom_in_params = None